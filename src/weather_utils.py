@@ -4,14 +4,178 @@ This module contains the core logic extracted from weather_fetcher.ipynb
 to enable unit testing.
 """
 
+import json
+import logging
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, Dict, Any
+from types import MappingProxyType
+from urllib.parse import urlencode
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# numpy/pandas are only needed for the vectorized batch helpers
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+logger = logging.getLogger(__name__)
 
 # Constants
 CALGARY_LAT = 51.0447
 CALGARY_LON = -114.0719
 WEATHER_API_URL = "https://api.open-meteo.com/v1/forecast"
+_REQUIRED_FIELDS = ("timestamp", "latitude", "longitude", "temperature", "city")
+_CURRENT_FIELDS = "temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,weather_code"
+
+# Shared stand-in for a response without a "current" block
+_NO_CURRENT = MappingProxyType({})
+
+# Query string for the default Calgary request, encoded once at import time
+_DEFAULT_QUERY = urlencode({
+    "latitude": CALGARY_LAT,
+    "longitude": CALGARY_LON,
+    "current": _CURRENT_FIELDS,
+    "timezone": "America/Edmonton"
+})
+
+
+@dataclass(frozen=True, slots=True)
+class WeatherRecord:
+    """
+    A single weather observation, with the same fields as the weather_schema
+    StructType used by the ingest notebook.
+    """
+    timestamp: datetime
+    latitude: Optional[float]
+    longitude: Optional[float]
+    temperature: Optional[float]
+    humidity: Optional[int]
+    wind_speed: Optional[float]
+    wind_direction: Optional[int]
+    weather_code: Optional[int]
+    city: str
+    fetch_time: datetime
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the record as a plain dictionary (e.g. for spark.createDataFrame).
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# Shared session so repeated fetches reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.2)),
+)
+
+# Open-Meteo only refreshes current conditions every ~15 minutes, so recent
+# successful fetches are reused instead of hitting the API again
+WEATHER_CACHE_TTL = 600
+_WEATHER_CACHE_MAXSIZE = 64
+_WEATHER_CACHE: Dict[Tuple[Any, ...], Tuple[float, WeatherRecord]] = {}
+
+# Last ETag and "current" block per request, so expired entries can be
+# revalidated with a conditional GET instead of re-downloading the payload
+_ETAG_CACHE: Dict[Tuple[Any, ...], Tuple[str, Dict[str, Any]]] = {}
+
+# WMO weather interpretation codes, built once at import time
+_WEATHER_CODES = MappingProxyType({
+    0: "Clear sky",
+    1: "Mainly clear",
+    2: "Partly cloudy",
+    3: "Overcast",
+    45: "Fog",
+    48: "Depositing rime fog",
+    51: "Light drizzle",
+    53: "Moderate drizzle",
+    55: "Dense drizzle",
+    61: "Slight rain",
+    63: "Moderate rain",
+    65: "Heavy rain",
+    71: "Slight snow",
+    73: "Moderate snow",
+    75: "Heavy snow",
+    77: "Snow grains",
+    80: "Slight rain showers",
+    81: "Moderate rain showers",
+    82: "Violent rain showers",
+    85: "Slight snow showers",
+    86: "Heavy snow showers",
+    95: "Thunderstorm",
+    96: "Thunderstorm with slight hail",
+    99: "Thunderstorm with heavy hail",
+})
+_WEATHER_CODES_GET = _WEATHER_CODES.get
+
+# Dense lookup table indexed directly by code (WMO codes are all in 0-99)
+_WEATHER_DESCRIPTIONS = tuple(_WEATHER_CODES_GET(code, "Unknown") for code in range(100))
+_WEATHER_DESCRIPTIONS_ARRAY = np.array(_WEATHER_DESCRIPTIONS, dtype=object) if np is not None else None
+
+
+def _current_block(data: Any) -> Dict[str, Any]:
+    """
+    Return the "current" block of one location's decoded response.
+    
+    Raises ValueError if the payload is not shaped like an Open-Meteo response.
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    current = data.get("current")
+    if not current:
+        return _NO_CURRENT
+    if not isinstance(current, dict):
+        raise ValueError(f"expected 'current' to be an object, got {type(current).__name__}")
+    return current
+
+
+def _build_record(
+    current: Dict[str, Any],
+    latitude: Any,
+    longitude: Any,
+    city: str,
+    fetch_time: Optional[datetime] = None
+) -> WeatherRecord:
+    """
+    Build a weather record from the "current" block of an Open-Meteo response.
+    
+    The clock is read at most once: the same time is used for fetch_time and,
+    if the response has no "time", for timestamp. Batch callers pass a shared
+    fetch_time so it is read once per batch.
+    """
+    now = fetch_time or datetime.now()
+    get = current.get
+    time_str = get("time")
+    if time_str is not None and not isinstance(time_str, str):
+        raise ValueError(f"expected 'time' to be a string, got {type(time_str).__name__}")
+    return WeatherRecord(
+        timestamp=datetime.fromisoformat(time_str) if time_str else now,
+        latitude=latitude,
+        longitude=longitude,
+        temperature=get("temperature_2m"),
+        humidity=get("relative_humidity_2m"),
+        wind_speed=get("wind_speed_10m"),
+        wind_direction=get("wind_direction_10m"),
+        weather_code=get("weather_code"),
+        city=city,
+        fetch_time=now
+    )
 
 
 def fetch_weather_data(
@@ -21,7 +185,7 @@ def fetch_weather_data(
     timezone: str = "America/Edmonton",
     api_url: str = WEATHER_API_URL,
     timeout: int = 10
-) -> Optional[Dict[str, Any]]:
+) -> Optional[WeatherRecord]:
     """
     Fetch current weather data from Open-Meteo API.
     
@@ -34,40 +198,124 @@ def fetch_weather_data(
         timeout: Request timeout in seconds
         
     Returns:
-        Dictionary with weather information or None if fetch fails
+        WeatherRecord with weather information or None if fetch fails.
+        Successful results are cached for WEATHER_CACHE_TTL seconds.
     """
-    try:
+    cache_key = (latitude, longitude, city, timezone, api_url)
+    cached = _WEATHER_CACHE.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] < WEATHER_CACHE_TTL:
+        return cached[1]
+    
+    request_key = (latitude, longitude, timezone, api_url)
+    validator = _ETAG_CACHE.get(request_key)
+    
+    if latitude == CALGARY_LAT and longitude == CALGARY_LON and timezone == "America/Edmonton":
+        params = _DEFAULT_QUERY
+    else:
         params = {
             "latitude": latitude,
             "longitude": longitude,
-            "current": "temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,weather_code",
+            "current": _CURRENT_FIELDS,
             "timezone": timezone
         }
+    headers = {"If-None-Match": validator[0]} if validator is not None else None
+    
+    try:
+        response = _SESSION.get(api_url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and validator is not None:
+            current, etag = validator[1], None
+        else:
+            if response.status_code >= 400:
+                logger.error("Error fetching weather data: HTTP %s", response.status_code)
+                return None
+            current = _current_block(_json_loads(response.content))
+            etag = response.headers.get("ETag")
         
-        response = requests.get(api_url, params=params, timeout=timeout)
-        response.raise_for_status()
+        record = _build_record(current, latitude, longitude, city)
+    except (requests.RequestException, ValueError) as e:
+        logger.error("Error fetching weather data: %s", e)
+        return None
+    
+    # Only remember payloads that produced a record, so a 304 never replays a bad one
+    if etag:
+        _cache_put(_ETAG_CACHE, request_key, (etag, current))
+    
+    # Failed fetches return above and are never cached
+    _cache_put(_WEATHER_CACHE, cache_key, (time.monotonic(), record))
+    return record
+
+
+def _cache_put(cache: Dict[Any, Any], key: Any, value: Any) -> None:
+    """
+    Insert into a bounded module cache, evicting the oldest entry when full.
+    """
+    cache.pop(key, None)
+    if len(cache) >= _WEATHER_CACHE_MAXSIZE:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+
+def clear_weather_cache() -> None:
+    """
+    Drop all cached results and ETags from fetch_weather_data.
+    """
+    _WEATHER_CACHE.clear()
+    _ETAG_CACHE.clear()
+
+
+def fetch_weather_data_many(
+    locations: List[Tuple[float, float, str]],
+    timezone: str = "America/Edmonton",
+    api_url: str = WEATHER_API_URL,
+    timeout: int = 10
+) -> Optional[List[WeatherRecord]]:
+    """
+    Fetch current weather for several locations with a single Open-Meteo request.
+    
+    Args:
+        locations: (latitude, longitude, city) tuples to fetch
+        timezone: Timezone for the weather data
+        api_url: The API endpoint URL
+        timeout: Request timeout in seconds
         
-        data = response.json()
-        current = data.get("current", {})
+    Returns:
+        List of weather records in the same order as locations,
+        or None if the fetch fails
+    """
+    if not locations:
+        return []
+    
+    params = {
+        "latitude": ",".join(str(lat) for lat, _, _ in locations),
+        "longitude": ",".join(str(lon) for _, lon, _ in locations),
+        "current": _CURRENT_FIELDS,
+        "timezone": timezone
+    }
+    
+    try:
+        response = _SESSION.get(api_url, params=params, timeout=timeout)
+        if response.status_code >= 400:
+            logger.error("Error fetching weather data: HTTP %s", response.status_code)
+            return None
+        data = _json_loads(response.content)
         
-        return {
-            "timestamp": datetime.fromisoformat(current.get("time", datetime.now().isoformat())),
-            "latitude": latitude,
-            "longitude": longitude,
-            "temperature": current.get("temperature_2m"),
-            "humidity": current.get("relative_humidity_2m"),
-            "wind_speed": current.get("wind_speed_10m"),
-            "wind_direction": current.get("wind_direction_10m"),
-            "weather_code": current.get("weather_code"),
-            "city": city,
-            "fetch_time": datetime.now()
-        }
-    except Exception as e:
-        print(f"Error fetching weather data: {e}")
+        # A single location comes back as an object rather than a list
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list) or len(data) != len(locations):
+            raise ValueError(f"expected {len(locations)} locations in response")
+        
+        fetch_time = datetime.now()
+        return [
+            _build_record(_current_block(item), latitude, longitude, city, fetch_time)
+            for item, (latitude, longitude, city) in zip(data, locations)
+        ]
+    except (requests.RequestException, ValueError) as e:
+        logger.error("Error fetching weather data: %s", e)
         return None
 
 
-def parse_weather_response(api_response: Dict[str, Any], city: str = "Calgary") -> Optional[Dict[str, Any]]:
+def parse_weather_response(api_response: Dict[str, Any], city: str = "Calgary") -> Optional[WeatherRecord]:
     """
     Parse the raw API response into a structured weather record.
     
@@ -76,97 +324,140 @@ def parse_weather_response(api_response: Dict[str, Any], city: str = "Calgary")
         city: City name to include in the record
         
     Returns:
-        Parsed weather data dictionary or None if parsing fails
+        Parsed WeatherRecord or None if parsing fails
     """
     try:
-        current = api_response.get("current", {})
+        current = api_response.get("current")
         
         if not current:
             return None
             
-        return {
-            "timestamp": datetime.fromisoformat(current.get("time", datetime.now().isoformat())),
-            "latitude": api_response.get("latitude"),
-            "longitude": api_response.get("longitude"),
-            "temperature": current.get("temperature_2m"),
-            "humidity": current.get("relative_humidity_2m"),
-            "wind_speed": current.get("wind_speed_10m"),
-            "wind_direction": current.get("wind_direction_10m"),
-            "weather_code": current.get("weather_code"),
-            "city": city,
-            "fetch_time": datetime.now()
-        }
+        return _build_record(current, api_response.get("latitude"), api_response.get("longitude"), city)
     except Exception as e:
-        print(f"Error parsing weather response: {e}")
+        logger.error("Error parsing weather response: %s", e)
         return None
 
 
-def validate_weather_record(record: Dict[str, Any]) -> bool:
+def validate_weather_record(record: Union[WeatherRecord, Dict[str, Any], None]) -> bool:
     """
     Validate that a weather record contains all required fields with valid values.
     
     Args:
-        record: Weather data dictionary to validate
+        record: WeatherRecord or weather data dictionary to validate
         
     Returns:
         True if valid, False otherwise
     """
-    required_fields = ["timestamp", "latitude", "longitude", "temperature", "city"]
-    
     if record is None:
         return False
-        
-    for field in required_fields:
-        if field not in record or record[field] is None:
-            return False
     
-    # Validate coordinate ranges
-    if not (-90 <= record["latitude"] <= 90):
-        return False
-    if not (-180 <= record["longitude"] <= 180):
-        return False
-        
-    # Validate temperature is reasonable (in Celsius)
-    if not (-100 <= record["temperature"] <= 60):
+    if isinstance(record, WeatherRecord):
+        timestamp, city = record.timestamp, record.city
+        latitude, longitude, temperature = record.latitude, record.longitude, record.temperature
+    else:
+        get = record.get
+        timestamp, city = get("timestamp"), get("city")
+        latitude, longitude, temperature = get("latitude"), get("longitude"), get("temperature")
+    
+    # Required fields (_REQUIRED_FIELDS), unrolled to avoid a Python-level loop
+    if timestamp is None or city is None or latitude is None or longitude is None or temperature is None:
         return False
+    
+    # Validate coordinate ranges and that temperature is reasonable (in Celsius)
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180 and -100 <= temperature <= 60
+
+
+def validate_weather_records(df: "pd.DataFrame") -> "pd.Series":
+    """
+    Vectorized validate_weather_record for a batch of records.
+    
+    Applies the same required-field and range checks column-wise, so whole
+    batches are validated without a Python call per row (e.g. inside a
+    Spark mapInPandas function).
+    
+    Args:
+        df: DataFrame with one weather record per row
         
-    return True
+    Returns:
+        Boolean Series aligned with df, True where the row is valid
+    """
+    if pd is None:
+        raise ImportError("validate_weather_records requires pandas")
+    
+    if not set(_REQUIRED_FIELDS).issubset(df.columns):
+        return pd.Series(False, index=df.index)
+    
+    latitude = pd.to_numeric(df["latitude"], errors="coerce")
+    longitude = pd.to_numeric(df["longitude"], errors="coerce")
+    temperature = pd.to_numeric(df["temperature"], errors="coerce")
+    
+    return (
+        df[list(_REQUIRED_FIELDS)].notna().all(axis=1)
+        & latitude.between(-90, 90)
+        & longitude.between(-180, 180)
+        & temperature.between(-100, 60)
+    )
 
 
 def get_weather_description(weather_code: int) -> str:
     """
     Convert WMO weather code to human-readable description.
     
+    Lookups index a precomputed tuple, so this is cheap enough to call once
+    per row without memoizing it.
+    
     Args:
         weather_code: WMO weather interpretation code
         
     Returns:
         Human-readable weather description
     """
-    weather_codes = {
-        0: "Clear sky",
-        1: "Mainly clear",
-        2: "Partly cloudy",
-        3: "Overcast",
-        45: "Fog",
-        48: "Depositing rime fog",
-        51: "Light drizzle",
-        53: "Moderate drizzle",
-        55: "Dense drizzle",
-        61: "Slight rain",
-        63: "Moderate rain",
-        65: "Heavy rain",
-        71: "Slight snow",
-        73: "Moderate snow",
-        75: "Heavy snow",
-        77: "Snow grains",
-        80: "Slight rain showers",
-        81: "Moderate rain showers",
-        82: "Violent rain showers",
-        85: "Slight snow showers",
-        86: "Heavy snow showers",
-        95: "Thunderstorm",
-        96: "Thunderstorm with slight hail",
-        99: "Thunderstorm with heavy hail",
-    }
-    return weather_codes.get(weather_code, "Unknown")
+    try:
+        return _WEATHER_DESCRIPTIONS[weather_code] if 0 <= weather_code < 100 else "Unknown"
+    except TypeError:
+        # None or non-integral codes (e.g. 3.0 from a float column)
+        return _WEATHER_CODES_GET(weather_code, "Unknown")
+
+
+def describe_weather_codes(codes: Any) -> Any:
+    """
+    Vectorized get_weather_description for an array of WMO codes.
+    
+    Looks every code up in the dense description table with a single numpy
+    gather instead of one Python call per row. A pandas Series in gives a
+    Series out, so this can be used directly as the body of a Spark
+    pandas_udf returning "string".
+    
+    Args:
+        codes: Array-like, pandas array or Series of integer codes
+            (NaN, None or pd.NA for missing)
+        
+    Returns:
+        Object array (or Series aligned with codes) of descriptions,
+        "Unknown" where a code has none
+    """
+    if np is None:
+        raise ImportError("describe_weather_codes requires numpy")
+    
+    if pd is not None:
+        if isinstance(codes, pd.Series):
+            return pd.Series(describe_weather_codes(codes.array), index=codes.index)
+        if isinstance(codes, pd.api.extensions.ExtensionArray):
+            # Nullable arrays (e.g. Int64) hold pd.NA, which numpy cannot cast to float
+            if pd.api.types.is_numeric_dtype(codes.dtype):
+                codes = codes.to_numpy(dtype=float, na_value=np.nan)
+            else:
+                codes = np.asarray(codes, dtype=object)
+    
+    codes = np.asarray(codes)
+    if codes.dtype.kind == "O":
+        # None/pd.NA (and anything non-numeric) become NaN
+        codes = pd.to_numeric(codes, errors="coerce") if pd is not None else codes.astype(float)
+    
+    mask = (codes >= 0) & (codes < 100)
+    index = np.where(mask, codes, 0).astype(np.intp)
+    if codes.dtype.kind == "f":
+        # Non-integral float codes have no description
+        mask &= index == codes
+    
+    return np.where(mask, _WEATHER_DESCRIPTIONS_ARRAY[index], "Unknown")
@@ -5,7 +5,9 @@ These tests run locally without requiring Spark or Databricks connectivity,
 making them suitable for CI/CD pipelines before bundle deployment.
 """
 
+import json
 import pytest
+import requests
 from unittest.mock import patch, Mock
 from datetime import datetime
 import sys
@@ -16,11 +18,18 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from weather_utils import (
     fetch_weather_data,
+    fetch_weather_data_many,
     parse_weather_response,
     validate_weather_record,
+    validate_weather_records,
     get_weather_description,
+    describe_weather_codes,
+    clear_weather_cache,
+    WEATHER_CACHE_TTL,
+    WeatherRecord,
     CALGARY_LAT,
     CALGARY_LON,
+    WEATHER_API_URL,
 )
 
 
@@ -28,6 +37,14 @@ from weather_utils import (
 # Test Fixtures
 # =============================================================================
 
+@pytest.fixture(autouse=True)
+def empty_weather_cache():
+    """Start every test without cached fetch results."""
+    clear_weather_cache()
+    yield
+    clear_weather_cache()
+
+
 @pytest.fixture
 def sample_api_response():
     """Sample Open-Meteo API response for testing."""
@@ -70,56 +87,284 @@ def valid_weather_record():
 class TestFetchWeatherData:
     """Tests for the fetch_weather_data function."""
     
-    @patch('weather_utils.requests.get')
+    @patch('weather_utils._SESSION.get')
     def test_successful_fetch(self, mock_get, sample_api_response):
         """Test successful API call returns weather data."""
-        mock_response = Mock()
-        mock_response.json.return_value = sample_api_response
-        mock_response.raise_for_status = Mock()
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
         mock_get.return_value = mock_response
         
         result = fetch_weather_data()
         
         assert result is not None
-        assert result["latitude"] == CALGARY_LAT
-        assert result["longitude"] == CALGARY_LON
-        assert result["temperature"] == -5.2
-        assert result["humidity"] == 72
-        assert result["city"] == "Calgary"
+        assert result.latitude == CALGARY_LAT
+        assert result.longitude == CALGARY_LON
+        assert result.temperature == -5.2
+        assert result.humidity == 72
+        assert result.city == "Calgary"
     
-    @patch('weather_utils.requests.get')
+    @patch('weather_utils._SESSION.get')
     def test_custom_coordinates(self, mock_get, sample_api_response):
         """Test fetch with custom coordinates."""
-        mock_response = Mock()
-        mock_response.json.return_value = sample_api_response
-        mock_response.raise_for_status = Mock()
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
         mock_get.return_value = mock_response
         
         result = fetch_weather_data(latitude=40.7128, longitude=-74.0060, city="New York")
         
-        assert result["latitude"] == 40.7128
-        assert result["longitude"] == -74.0060
-        assert result["city"] == "New York"
+        assert result.latitude == 40.7128
+        assert result.longitude == -74.0060
+        assert result.city == "New York"
     
-    @patch('weather_utils.requests.get')
-    def test_api_timeout(self, mock_get):
+    @patch('weather_utils._SESSION.get')
+    def test_response_without_current(self, mock_get):
+        """Test that a response without current data yields empty measurements."""
+        mock_get.return_value = Mock(status_code=200, headers={}, content=b'{"latitude": 51.05}')
+        
+        result = fetch_weather_data()
+        
+        assert result.temperature is None
+        assert result.weather_code is None
+        assert result.city == "Calgary"
+    
+    @patch('weather_utils._SESSION.get')
+    def test_default_query_matches_encoded_params(self, mock_get, sample_api_response):
+        """Test that the pre-encoded default query builds the same URL as a params dict."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.return_value = mock_response
+        
+        fetch_weather_data()
+        
+        expected = requests.Request("GET", WEATHER_API_URL, params={
+            "latitude": CALGARY_LAT,
+            "longitude": CALGARY_LON,
+            "current": "temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,weather_code",
+            "timezone": "America/Edmonton",
+        }).prepare().url
+        params = mock_get.call_args.kwargs["params"]
+        assert isinstance(params, str)
+        assert requests.Request("GET", WEATHER_API_URL, params=params).prepare().url == expected
+    
+    @patch('weather_utils._SESSION.get')
+    def test_api_timeout(self, mock_get, caplog):
         """Test that timeout errors are handled gracefully."""
-        mock_get.side_effect = Exception("Connection timeout")
+        mock_get.side_effect = requests.Timeout("Connection timeout")
         
         result = fetch_weather_data()
         
         assert result is None
+        assert "Connection timeout" in caplog.text
     
-    @patch('weather_utils.requests.get')
+    @patch('weather_utils._SESSION.get')
     def test_api_error_response(self, mock_get):
         """Test that HTTP errors are handled gracefully."""
-        mock_response = Mock()
-        mock_response.raise_for_status.side_effect = Exception("404 Not Found")
+        mock_response = Mock(status_code=404, headers={})
         mock_get.return_value = mock_response
         
         result = fetch_weather_data()
         
         assert result is None
+    
+    @patch('weather_utils._SESSION.get')
+    def test_invalid_json_body(self, mock_get):
+        """Test that an undecodable response body is handled gracefully."""
+        mock_get.return_value = Mock(status_code=200, headers={}, content=b"<html>")
+        
+        result = fetch_weather_data()
+        
+        assert result is None
+    
+    @pytest.mark.parametrize("body", [b"null", b"[1, 2]", b'"x"', b'{"current": 5}', b'{"current": {"time": 123}}'])
+    @patch('weather_utils._SESSION.get')
+    def test_malformed_json_body(self, mock_get, body):
+        """Test that valid JSON of the wrong shape is handled gracefully."""
+        mock_get.return_value = Mock(status_code=200, headers={}, content=body)
+        
+        result = fetch_weather_data()
+        
+        assert result is None
+    
+    @patch('weather_utils._SESSION.get')
+    def test_invalid_time_in_response(self, mock_get):
+        """Test that an unparseable timestamp is handled gracefully."""
+        mock_get.return_value = Mock(status_code=200, headers={}, content=b'{"current": {"time": "garbage"}}')
+        
+        result = fetch_weather_data()
+        
+        assert result is None
+    
+    @patch('weather_utils._SESSION.get')
+    def test_repeated_fetch_uses_cache(self, mock_get, sample_api_response):
+        """Test that a second identical fetch is served from the cache."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.return_value = mock_response
+        
+        first = fetch_weather_data()
+        second = fetch_weather_data()
+        
+        assert mock_get.call_count == 1
+        assert second == first
+        
+        fetch_weather_data(city="Airdrie")
+        assert mock_get.call_count == 2
+    
+    @patch('weather_utils._SESSION.get')
+    def test_failed_fetch_not_cached(self, mock_get, sample_api_response):
+        """Test that a failed fetch is retried on the next call."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.side_effect = [requests.Timeout("Connection timeout"), mock_response]
+        
+        assert fetch_weather_data() is None
+        assert fetch_weather_data() is not None
+        assert mock_get.call_count == 2
+    
+    @patch('weather_utils.time.monotonic')
+    @patch('weather_utils._SESSION.get')
+    def test_not_modified_reuses_last_payload(self, mock_get, mock_monotonic, sample_api_response):
+        """Test that a 304 after the TTL expires reuses the last payload."""
+        mock_response = Mock(status_code=200, headers={"ETag": '"abc"'})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.return_value = mock_response
+        mock_monotonic.return_value = 1000.0
+        fetch_weather_data()
+        
+        mock_get.return_value = Mock(status_code=304, headers={}, content=b"")
+        mock_monotonic.return_value = 1000.0 + WEATHER_CACHE_TTL
+        result = fetch_weather_data()
+        
+        assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": '"abc"'}
+        assert result.temperature == -5.2
+    
+    @patch('weather_utils._SESSION.get')
+    def test_bad_payload_etag_not_reused(self, mock_get):
+        """Test that a payload that failed to parse is never replayed on a 304."""
+        mock_get.return_value = Mock(
+            status_code=200, headers={"ETag": '"bad"'}, content=b'{"current": {"time": "garbage"}}'
+        )
+        assert fetch_weather_data() is None
+        
+        mock_get.return_value = Mock(status_code=304, headers={}, content=b"")
+        fetch_weather_data()
+        
+        assert mock_get.call_args.kwargs["headers"] is None
+    
+    @patch('weather_utils.time.monotonic')
+    @patch('weather_utils._SESSION.get')
+    def test_cache_expires_after_ttl(self, mock_get, mock_monotonic, sample_api_response):
+        """Test that cached results are refetched once the TTL has passed."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.return_value = mock_response
+        
+        mock_monotonic.return_value = 1000.0
+        fetch_weather_data()
+        mock_monotonic.return_value = 1000.0 + WEATHER_CACHE_TTL
+        fetch_weather_data()
+        
+        assert mock_get.call_count == 2
+
+
+# =============================================================================
+# Tests for fetch_weather_data_many
+# =============================================================================
+
+class TestFetchWeatherDataMany:
+    """Tests for the fetch_weather_data_many function."""
+    
+    @patch('weather_utils._SESSION.get')
+    def test_multiple_locations_single_request(self, mock_get, sample_api_response):
+        """Test that several locations are fetched with one request."""
+        edmonton_response = dict(sample_api_response, current=dict(sample_api_response["current"], temperature_2m=-9.0))
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps([sample_api_response, edmonton_response]).encode()
+        mock_get.return_value = mock_response
+        
+        result = fetch_weather_data_many([
+            (CALGARY_LAT, CALGARY_LON, "Calgary"),
+            (53.5461, -113.4938, "Edmonton"),
+        ])
+        
+        assert mock_get.call_count == 1
+        params = mock_get.call_args.kwargs["params"]
+        assert params["latitude"] == f"{CALGARY_LAT},53.5461"
+        assert params["longitude"] == f"{CALGARY_LON},-113.4938"
+        assert [r.city for r in result] == ["Calgary", "Edmonton"]
+        assert [r.temperature for r in result] == [-5.2, -9.0]
+        assert result[1].latitude == 53.5461
+        assert result[0].fetch_time == result[1].fetch_time
+    
+    @patch('weather_utils._SESSION.get')
+    def test_single_location_object_response(self, mock_get, sample_api_response):
+        """Test that a single-location object response is handled."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.return_value = mock_response
+        
+        result = fetch_weather_data_many([(CALGARY_LAT, CALGARY_LON, "Calgary")])
+        
+        assert len(result) == 1
+        assert result[0].temperature == -5.2
+    
+    @patch('weather_utils._SESSION.get')
+    def test_no_locations(self, mock_get):
+        """Test that an empty location list makes no request."""
+        assert fetch_weather_data_many([]) == []
+        mock_get.assert_not_called()
+    
+    @patch('weather_utils._SESSION.get')
+    def test_api_error_response(self, mock_get):
+        """Test that HTTP errors fail the whole batch gracefully."""
+        mock_get.return_value = Mock(status_code=500, headers={})
+        
+        result = fetch_weather_data_many([(CALGARY_LAT, CALGARY_LON, "Calgary")])
+        
+        assert result is None
+    
+    @pytest.mark.parametrize("body", [b"null", b"[1, 2]", b'"x"', b'{"current": 5}', b'{"current": {"time": 123}}'])
+    @patch('weather_utils._SESSION.get')
+    def test_malformed_json_body(self, mock_get, body):
+        """Test that valid JSON of the wrong shape fails the batch gracefully."""
+        mock_get.return_value = Mock(status_code=200, headers={}, content=body)
+        
+        result = fetch_weather_data_many([
+            (CALGARY_LAT, CALGARY_LON, "Calgary"),
+            (53.5461, -113.4938, "Edmonton"),
+        ])
+        
+        assert result is None
+    
+    @pytest.mark.parametrize("bad_time", ["garbage", 5])
+    @patch('weather_utils._SESSION.get')
+    def test_invalid_time_in_response(self, mock_get, bad_time, sample_api_response):
+        """Test that an unparseable timestamp fails the batch gracefully."""
+        mock_get.return_value = Mock(status_code=200, headers={}, content=json.dumps([
+            sample_api_response,
+            {"current": {"time": bad_time}},
+        ]).encode())
+        
+        result = fetch_weather_data_many([
+            (CALGARY_LAT, CALGARY_LON, "Calgary"),
+            (53.5461, -113.4938, "Edmonton"),
+        ])
+        
+        assert result is None
+    
+    @patch('weather_utils._SESSION.get')
+    def test_mismatched_response_length(self, mock_get, sample_api_response):
+        """Test that a response missing locations is treated as a failure."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps([sample_api_response]).encode()
+        mock_get.return_value = mock_response
+        
+        result = fetch_weather_data_many([
+            (CALGARY_LAT, CALGARY_LON, "Calgary"),
+            (53.5461, -113.4938, "Edmonton"),
+        ])
+        
+        assert result is None
 
 
 # =============================================================================
@@ -134,17 +379,17 @@ class TestParseWeatherResponse:
         result = parse_weather_response(sample_api_response)
         
         assert result is not None
-        assert result["temperature"] == -5.2
-        assert result["humidity"] == 72
-        assert result["wind_speed"] == 15.5
-        assert result["weather_code"] == 3
-        assert result["city"] == "Calgary"
+        assert result.temperature == -5.2
+        assert result.humidity == 72
+        assert result.wind_speed == 15.5
+        assert result.weather_code == 3
+        assert result.city == "Calgary"
     
     def test_parse_with_custom_city(self, sample_api_response):
         """Test parsing with a custom city name."""
         result = parse_weather_response(sample_api_response, city="Edmonton")
         
-        assert result["city"] == "Edmonton"
+        assert result.city == "Edmonton"
     
     def test_parse_empty_response(self):
         """Test parsing an empty response."""
@@ -173,8 +418,39 @@ class TestParseWeatherResponse:
         result = parse_weather_response(response)
         
         assert result is not None
-        assert result["temperature"] == -5.2
-        assert result["humidity"] is None  # Missing field should be None
+        assert result.temperature == -5.2
+        assert result.humidity is None  # Missing field should be None
+    
+    def test_parse_missing_time_uses_now(self):
+        """Test that a response without a time falls back to the current time."""
+        response = {"latitude": 51.05, "longitude": -114.05, "current": {"temperature_2m": -5.2}}
+        before = datetime.now()
+        result = parse_weather_response(response)
+        
+        assert before <= result.timestamp <= datetime.now()
+        assert result.timestamp == result.fetch_time
+
+
+# =============================================================================
+# Tests for WeatherRecord
+# =============================================================================
+
+class TestWeatherRecord:
+    """Tests for the WeatherRecord dataclass."""
+    
+    def test_to_dict_round_trip(self, valid_weather_record):
+        """Test that to_dict returns the original field mapping."""
+        record = WeatherRecord(**valid_weather_record)
+        
+        assert record.to_dict() == valid_weather_record
+        assert list(record.to_dict()) == list(valid_weather_record)
+    
+    def test_record_is_immutable(self, valid_weather_record):
+        """Test that records cannot be modified after creation."""
+        record = WeatherRecord(**valid_weather_record)
+        
+        with pytest.raises(AttributeError):
+            record.temperature = 20.0
 
 
 # =============================================================================
@@ -188,6 +464,13 @@ class TestValidateWeatherRecord:
         """Test that a valid record passes validation."""
         assert validate_weather_record(valid_weather_record) is True
     
+    def test_valid_weather_record_instance(self, valid_weather_record):
+        """Test that WeatherRecord instances are validated like dictionaries."""
+        assert validate_weather_record(WeatherRecord(**valid_weather_record)) is True
+        
+        valid_weather_record["longitude"] = 200
+        assert validate_weather_record(WeatherRecord(**valid_weather_record)) is False
+    
     def test_none_record(self):
         """Test that None fails validation."""
         assert validate_weather_record(None) is False
@@ -235,6 +518,38 @@ class TestValidateWeatherRecord:
         assert validate_weather_record(valid_weather_record) is True
 
 
+# =============================================================================
+# Tests for validate_weather_records
+# =============================================================================
+
+class TestValidateWeatherRecords:
+    """Tests for the vectorized validate_weather_records function."""
+    
+    def test_matches_scalar_validation(self, valid_weather_record):
+        """Test that each row gets the same verdict as validate_weather_record."""
+        pd = pytest.importorskip("pandas")
+        records = [
+            valid_weather_record,
+            dict(valid_weather_record, latitude=100),
+            dict(valid_weather_record, longitude=-200),
+            dict(valid_weather_record, temperature=-150),
+            dict(valid_weather_record, temperature=None),
+            dict(valid_weather_record, city=None),
+            dict(valid_weather_record, latitude=90, longitude=-180),
+        ]
+        
+        result = validate_weather_records(pd.DataFrame(records))
+        
+        assert result.tolist() == [validate_weather_record(r) for r in records]
+    
+    def test_missing_required_column(self, valid_weather_record):
+        """Test that a batch missing a required column is entirely invalid."""
+        pd = pytest.importorskip("pandas")
+        df = pd.DataFrame([valid_weather_record, valid_weather_record]).drop(columns=["city"])
+        
+        assert validate_weather_records(df).tolist() == [False, False]
+
+
 # =============================================================================
 # Tests for get_weather_description
 # =============================================================================
@@ -260,7 +575,14 @@ class TestGetWeatherDescription:
         """Test that unknown codes return 'Unknown'."""
         assert get_weather_description(999) == "Unknown"
         assert get_weather_description(-1) == "Unknown"
-    
+        assert get_weather_description(4) == "Unknown"
+
+    def test_missing_or_float_weather_code(self):
+        """Test that None and float codes behave like a dict lookup."""
+        assert get_weather_description(None) == "Unknown"
+        assert get_weather_description(3.0) == "Overcast"
+        assert get_weather_description(3.5) == "Unknown"
+
     def test_calgary_winter_codes(self):
         """Test weather codes common in Calgary winters."""
         # Snow codes
@@ -270,6 +592,82 @@ class TestGetWeatherDescription:
         assert get_weather_description(77) == "Snow grains"
 
 
+# =============================================================================
+# Tests for describe_weather_codes
+# =============================================================================
+
+class TestDescribeWeatherCodes:
+    """Tests for the vectorized describe_weather_codes function."""
+    
+    def test_matches_scalar_lookup(self):
+        """Test that every code gets the same description as the scalar function."""
+        np = pytest.importorskip("numpy")
+        codes = np.array([0, 3, 45, 71, 99, 4, -1, 100, 999])
+        
+        result = describe_weather_codes(codes)
+        
+        assert result.tolist() == [get_weather_description(int(c)) for c in codes]
+    
+    def test_missing_and_float_codes(self):
+        """Test that NaN, None and non-integral codes are 'Unknown'."""
+        np = pytest.importorskip("numpy")
+        
+        assert describe_weather_codes(np.array([3.0, np.nan, 3.5])).tolist() == ["Overcast", "Unknown", "Unknown"]
+        assert describe_weather_codes([71, None]).tolist() == ["Slight snow", "Unknown"]
+    
+    def test_pandas_missing_values(self):
+        """Test that pd.NA in object and nullable arrays is 'Unknown'."""
+        np = pytest.importorskip("numpy")
+        pd = pytest.importorskip("pandas")
+        
+        assert describe_weather_codes(np.array([1, pd.NA], dtype=object)).tolist() == ["Mainly clear", "Unknown"]
+        assert describe_weather_codes(pd.array([3, None], dtype="Int64")).tolist() == ["Overcast", "Unknown"]
+    
+    def test_series_in_series_out(self):
+        """Test that a pandas Series (e.g. in a pandas_udf) keeps its index."""
+        pd = pytest.importorskip("pandas")
+        codes = pd.Series([3, None, 95], index=[10, 11, 12], dtype="Int64")
+        
+        result = describe_weather_codes(codes)
+        
+        assert isinstance(result, pd.Series)
+        assert result.index.tolist() == [10, 11, 12]
+        assert result.tolist() == ["Overcast", "Unknown", "Thunderstorm"]
+
+
+# =============================================================================
+# Tests for optional dependency fallbacks
+# =============================================================================
+
+class TestOptionalDependencies:
+    """Tests for behaviour when optional packages are not installed."""
+    
+    @patch('weather_utils.pd', None)
+    def test_validate_weather_records_without_pandas(self, valid_weather_record):
+        """Test that the vectorized validator reports missing pandas."""
+        with pytest.raises(ImportError, match="pandas"):
+            validate_weather_records([valid_weather_record])
+    
+    @patch('weather_utils.np', None)
+    def test_describe_weather_codes_without_numpy(self):
+        """Test that the vectorized description lookup reports missing numpy."""
+        with pytest.raises(ImportError, match="numpy"):
+            describe_weather_codes([0, 3])
+    
+    @patch('weather_utils._json_loads', json.loads)
+    @patch('weather_utils._SESSION.get')
+    def test_fetch_with_stdlib_json(self, mock_get, sample_api_response):
+        """Test that responses decode with the stdlib json fallback."""
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
+        mock_get.return_value = mock_response
+        
+        result = fetch_weather_data()
+        
+        assert result.temperature == -5.2
+        assert result.weather_code == 3
+
+
 # =============================================================================
 # Integration-style tests (still no Spark required)
 # =============================================================================
@@ -277,12 +675,11 @@ class TestGetWeatherDescription:
 class TestWeatherPipelineFlow:
     """Tests that verify the flow of data through multiple functions."""
     
-    @patch('weather_utils.requests.get')
+    @patch('weather_utils._SESSION.get')
     def test_fetch_and_validate_flow(self, mock_get, sample_api_response):
         """Test fetching data and validating it."""
-        mock_response = Mock()
-        mock_response.json.return_value = sample_api_response
-        mock_response.raise_for_status = Mock()
+        mock_response = Mock(status_code=200, headers={})
+        mock_response.content = json.dumps(sample_api_response).encode()
         mock_get.return_value = mock_response
         
         # Fetch the data
@@ -307,7 +704,7 @@ class TestWeatherPipelineFlow:
         """Test getting weather description from parsed data."""
         parsed = parse_weather_response(sample_api_response)
         
-        description = get_weather_description(parsed["weather_code"])
+        description = get_weather_description(parsed.weather_code)
         
         assert description == "Overcast"  # Code 3
 